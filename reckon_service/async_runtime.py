@@ -0,0 +1,280 @@
+"""
+RECKON Client - Asyncio Runtime
+Purpose: Runs the Client State Machine (Initializing -> Running) as cooperative
+tasks on a single event loop: registration, heartbeat, telemetry sampling and
+command handling no longer block each other.
+Reference: Protocol Doc Section 2 and 3
+"""
+import asyncio
+import concurrent.futures
+import json
+import requests
+import gpu_driver
+import config_manager
+import watchdog
+import protocol
+
+# --- TASK DEADLINES ---
+# Blocking calls run in single-worker executors. A deadline stops the waiting
+# task, not the call: the worker stays busy until the call returns, so
+# _call() never queues a new call behind one that is still running.
+# Each deadline covers both waiting for the worker and the call itself.
+# The HTTP deadline covers a connect plus one full read timeout. A server
+# that sends its reply slowly can outlast it (see protocol.HTTP_* timeouts).
+HTTP_DEADLINE_SECONDS = (protocol.HTTP_CONNECT_TIMEOUT_SECONDS
+                         + protocol.HTTP_READ_TIMEOUT_SECONDS + 5)
+INVENTORY_DEADLINE_SECONDS = gpu_driver.AMD_INFO_TIMEOUT_SECONDS + 5
+SAMPLE_DEADLINE_SECONDS = 10
+
+
+class AsyncRuntime:
+    def __init__(self):
+        # SAFETY: One worker per blocking source. A stuck GPU query cannot
+        # starve EMS I/O and vice versa, and the thread count stays fixed.
+        self._ems_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="reckon-ems")
+        self._gpu_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="reckon-gpu")
+        self._abandoned = {}  # executor -> (key, future) of a call that outlived its deadline
+        self._samples = None
+        self._commands = None
+
+    async def run(self):
+        """
+        Main State Machine Entry Point (asyncio).
+        """
+        # Loop-bound primitives must be created inside the running loop
+        self._samples = asyncio.Queue(maxsize=1)
+        self._commands = asyncio.Queue()
+
+        try:
+            while True:
+                watchdog.feed_watchdog()
+
+                if config_manager.load_secrets():
+                    print("Found saved credentials. Resuming operation...")
+                else:
+                    await self._register_node()
+
+                await self._run_node()
+
+                # SAFETY: Prevents rapid restart loop if the RUNNING state exits
+                delay = config_manager.MAIN_LOOP_RESTART_DELAY_SECONDS
+                print(f"Service loop restarting. Waiting {delay}s before retry...")
+                await asyncio.sleep(delay)
+        finally:
+            self._ems_executor.shutdown(wait=False)
+            self._gpu_executor.shutdown(wait=False)
+
+    async def _call(self, executor, key, deadline, func, *args, **kwargs):
+        """
+        Run a blocking call in an executor, bounded by one deadline.
+        A call that outlives its deadline keeps running on the worker and is
+        remembered. A later call with the same non-None key takes that call's
+        result, even if it finished in the meantime, instead of sending a
+        duplicate. Only pass a key for idempotent calls. Any other call waits
+        for the worker within its own deadline.
+        """
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + deadline
+
+        abandoned = self._abandoned.pop(executor, None)
+        if abandoned is not None:
+            abandoned_key, future = abandoned
+            if key is not None and abandoned_key == key:
+                return await self._await_until(executor, key, future, expires)
+            if not future.done():
+                await asyncio.wait({future}, timeout=max(expires - loop.time(), 0))
+                if not future.done():
+                    self._abandoned[executor] = abandoned
+                    raise asyncio.TimeoutError()
+
+        future = loop.run_in_executor(executor, lambda: func(*args, **kwargs))
+        future.add_done_callback(_retrieve_exception)
+        return await self._await_until(executor, key, future, expires)
+
+    async def _await_until(self, executor, key, future, expires):
+        """Waits for future until expires; remembers it if it is abandoned."""
+        remaining = max(expires - asyncio.get_running_loop().time(), 0)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), remaining)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Also on task teardown: the worker may still be busy with this
+            # call, and a keyed caller may still want its result
+            self._abandoned[executor] = (key, future)
+            raise
+
+    def _worker_busy(self, executor):
+        """True while a call that outlived its deadline still occupies the worker."""
+        abandoned = self._abandoned.get(executor)
+        return abandoned is not None and not abandoned[1].done()
+
+    async def _post(self, url, payload, headers=None, key=None):
+        return await self._call(
+            self._ems_executor, key, HTTP_DEADLINE_SECONDS,
+            protocol.post_json, url, payload, headers=headers)
+
+    async def _register_node(self):
+        """
+        Handles the INITIALIZING state.
+        Sends inventory to server and waits for approval.
+        """
+        print("\n[STATE] INITIALIZING...")
+
+        try:
+            inventory = await self._call(
+                self._gpu_executor, None, INVENTORY_DEADLINE_SECONDS,
+                gpu_driver.get_gpu_inventory)
+        except asyncio.TimeoutError:
+            print(f"WARNING: GPU inventory timed out after {INVENTORY_DEADLINE_SECONDS}s. Registering without inventory.")
+            inventory = []
+
+        payload = protocol.build_registration_payload(inventory)
+        url = protocol.initialize_url()
+        # /initialize is idempotent: a retry may take a timed-out attempt's result
+        key = (url, json.dumps(payload, sort_keys=True))
+
+        while True:
+            try:
+                # Feed watchdog during registration to prevent timeout
+                watchdog.feed_watchdog()
+
+                print(f"Sending registration request to {url}...")
+                response = await self._post(url, payload, key=key)
+
+                action, data = protocol.handle_registration_response(response)
+                if action == protocol.REGISTERED:
+                    return data
+                await asyncio.sleep(protocol.registration_retry_delay(action))
+
+            except requests.exceptions.RequestException as e:
+                print(f"NETWORK ERROR: {e}. Retrying in {protocol.ERROR_RETRY_DELAY_SECONDS}s...")
+                await asyncio.sleep(protocol.ERROR_RETRY_DELAY_SECONDS)
+            except asyncio.TimeoutError:
+                print(f"NETWORK ERROR: registration exceeded {HTTP_DEADLINE_SECONDS}s deadline. Retrying in {protocol.ERROR_RETRY_DELAY_SECONDS}s...")
+                await asyncio.sleep(protocol.ERROR_RETRY_DELAY_SECONDS)
+
+    async def _run_node(self):
+        """
+        Handles the RUNNING state.
+        Sampling, heartbeat and command handling run as sibling tasks; when
+        the heartbeat task returns (token revoked) all of them are torn down.
+        """
+        print("\n[STATE] RUNNING")
+
+        credentials = protocol.load_credentials()
+        if not credentials:
+            return
+
+        # Drop any sample left over from a previous RUNNING state
+        while not self._samples.empty():
+            self._samples.get_nowait()
+
+        sampler = asyncio.ensure_future(self._sampling_loop())
+        heartbeat = asyncio.ensure_future(
+            self._heartbeat_loop(*credentials))
+        commands = asyncio.ensure_future(self._command_loop())
+        tasks = [sampler, heartbeat, commands]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                # Re-raise unexpected errors so main() can fall back
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _heartbeat_loop(self, node_id, token):
+        """
+        Sends each telemetry sample as soon as the sampler publishes it.
+        Returns when the token is revoked.
+        """
+        url = protocol.heartbeat_url()
+        headers = {"Authorization": f"Bearer {token}"}
+
+        while True:
+            telemetry = await self._samples.get()
+
+            # Never reuse or queue behind another beat's request
+            if self._worker_busy(self._ems_executor):
+                print("Network Error: previous request still running. Skipping heartbeat.")
+                continue
+
+            try:
+                payload = protocol.build_heartbeat_payload(node_id, telemetry)
+
+                print(f"Sending Heartbeat... (Gpus: {len(telemetry)})")
+                response = await self._post(url, payload, headers=headers)
+
+                action, data = protocol.handle_heartbeat_response(response)
+                if action == protocol.HEARTBEAT_ACCEPTED:
+                    watchdog.feed_watchdog()
+                    if isinstance(data, dict) and data.get("command"):
+                        self._commands.put_nowait(data)
+
+                elif action == protocol.REINITIALIZE:
+                    return
+
+            except requests.exceptions.RequestException as e:
+                print(f"Network Error: {e}")
+            except asyncio.TimeoutError:
+                print(f"Network Error: heartbeat exceeded {HTTP_DEADLINE_SECONDS}s deadline")
+
+    async def _sampling_loop(self):
+        """
+        Sets the heartbeat cadence: samples GPU telemetry once per interval
+        and hands it to the heartbeat task, so each beat carries a fresh sample.
+        A failed or timed-out sample is sent as an empty list, matching
+        gpu_driver.get_gpu_telemetry's own failure behaviour.
+        """
+        interval = config_manager.DEFAULT_HEARTBEAT_INTERVAL
+        loop = asyncio.get_running_loop()
+
+        while True:
+            started = loop.time()
+            try:
+                telemetry = await self._call(
+                    self._gpu_executor, None, SAMPLE_DEADLINE_SECONDS,
+                    gpu_driver.get_gpu_telemetry)
+            except asyncio.TimeoutError:
+                print(f"WARNING: Telemetry sample exceeded {SAMPLE_DEADLINE_SECONDS}s deadline")
+                telemetry = []
+            except Exception as e:
+                print(f"WARNING: Telemetry sampling failed: {e}")
+                telemetry = []
+
+            # If the previous beat is still being sent, replace its unsent sample
+            if self._samples.full():
+                self._samples.get_nowait()
+            self._samples.put_nowait(telemetry)
+
+            # SAFETY: Sleep is OUTSIDE try/except to always execute.
+            # Measured from the start of the sample so the cadence stays fixed.
+            elapsed = loop.time() - started
+            await asyncio.sleep(max(interval - elapsed, 0))
+
+    async def _command_loop(self):
+        """
+        Processes commands returned by the EMS in heartbeat responses.
+        """
+        while True:
+            data = await self._commands.get()
+            command = data.get("command")
+            # Power control is disabled until apply_power_limit is re-enabled.
+            if command == "adjust_power":
+                target_w = data.get("setpoint_power_w", 1500)
+                print(f"COMMAND RECEIVED: Adjust Power to {target_w}W (power control disabled, ignoring)")
+            else:
+                print(f"COMMAND RECEIVED: Unknown command '{command}', ignoring")
+
+
+def _retrieve_exception(future):
+    """Marks an abandoned call's exception as retrieved so asyncio does not log it."""
+    if not future.cancelled():
+        future.exception()
+
+
+def run():
+    """Run the asyncio runtime until it exits or raises."""
+    asyncio.run(AsyncRuntime().run())
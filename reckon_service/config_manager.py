@@ -21,6 +21,10 @@ SECRETS_FILE = os.getenv("SECRETS_FILE", "secrets.json")
 # Client configuration
 DEFAULT_HEARTBEAT_INTERVAL = int(os.getenv("DEFAULT_HEARTBEAT_INTERVAL", "60"))
 RETRY_DELAY = int(os.getenv("RETRY_DELAY", "60"))
+MAIN_LOOP_RESTART_DELAY_SECONDS = 30  # Delay before restarting main loop
+
+# Runtime selection: "threaded" (blocking state machine) or "async" (asyncio tasks)
+RUNTIME_MODE = os.getenv("RUNTIME_MODE", "threaded").strip().lower()
 
 # Redaction configuration
 NODE_ID_REDACTION_LENGTH = 8  # Number of characters to show when redacting node IDs
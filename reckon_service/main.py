@@ -12,11 +12,12 @@ import os
 import gpu_driver
 import config_manager
 import watchdog
+import protocol
+import async_runtime
 
 # --- CONSTANTS ---
 DEFAULT_HEARTBEAT_INTERVAL = config_manager.DEFAULT_HEARTBEAT_INTERVAL
-RETRY_DELAY = config_manager.RETRY_DELAY
-MAIN_LOOP_RESTART_DELAY_SECONDS = 30  # Delay before restarting main loop
+MAIN_LOOP_RESTART_DELAY_SECONDS = config_manager.MAIN_LOOP_RESTART_DELAY_SECONDS
 '''
 def apply_power_limit(target_total_watts, gpu_count):
     """
@@ -58,18 +59,9 @@ def register_node():
     print("\n[STATE] INITIALIZING...")
     
     inventory = gpu_driver.get_gpu_inventory()
-    
-    payload = {
-        "model": "RECKON_RIG_GEN1",
-        "fw_version": "1.0.0",
-        "capabilities": {
-            "max_power_w": 900, # Physical max
-            "min_power_w": 540
-        },
-        "gpu_inventory": inventory
-    }
-
-    url = f"{config_manager.EMS_API_URL}/api/v1/nodes/initialize"
+    payload = protocol.build_registration_payload(inventory)
+
+    url = protocol.initialize_url()
     
     while True:
         try:
@@ -77,41 +69,16 @@ def register_node():
             watchdog.feed_watchdog()
             
             print(f"Sending registration request to {url}...")
-            response = requests.post(url, json=payload, timeout=10)
+            response = protocol.post_json(url, payload)
             
-            # CASE 1: 200 OK -> Approved
-            if response.status_code == 200:
-                data = response.json()
-                print("SUCCESS: Node Approved!")
-                config_manager.save_secrets(data["node_id"], data["api_token"])
-                return data # Return config to start running            
-
-            # CASE 2: 202 Accepted -> Pending Approval
-            elif response.status_code == 202:
-                print("202 body:", response.text)
-
-                data = {}
-                try:
-                    data = response.json()  # server should return node_id here
-                except Exception:
-                    pass
-
-                node_id = data.get("node_id")
-                if node_id:
-                    # save node_id locally even without token (implement this)
-                    config_manager.save_pending_node_id(node_id)
-
-                print(f"PENDING: Waiting for admin approval. Retrying in {RETRY_DELAY}s...")
-                time.sleep(RETRY_DELAY)
-                
-            # CASE 3: Error
-            else:
-                print(f"ERROR: Server returned {response.status_code}. Retrying...")
-                time.sleep(30)
+            action, data = protocol.handle_registration_response(response)
+            if action == protocol.REGISTERED:
+                return data # Return config to start running
+            time.sleep(protocol.registration_retry_delay(action))
                 
         except requests.exceptions.RequestException as e:
-            print(f"NETWORK ERROR: {e}. Retrying in 30s...")
-            time.sleep(30)
+            print(f"NETWORK ERROR: {e}. Retrying in {protocol.ERROR_RETRY_DELAY_SECONDS}s...")
+            time.sleep(protocol.ERROR_RETRY_DELAY_SECONDS)
 
 
 
@@ -124,24 +91,15 @@ def start_heartbeat_loop(initial_config):
     print("\n[STATE] RUNNING")
     
     # Load secrets (Node ID and Token)
-    secrets = config_manager.load_secrets()
-    if not secrets:
-        print("CRITICAL: Secrets lost. Restarting initialization.")
-        return # Go back to main loop
-        
-    node_id = secrets["node_id"]
-    token = secrets["api_token"]
-    
-    # SAFETY: Guard against null/empty token to prevent infinite loop
-    if not token:
-        print("CRITICAL: api_token is null or empty. Deleting secrets.")
-        config_manager.delete_secrets()
+    credentials = protocol.load_credentials()
+    if not credentials:
         return # Go back to main loop
+    node_id, token = credentials
     
     # Her zaman sadece env'den al
     interval = DEFAULT_HEARTBEAT_INTERVAL
     
-    url = f"{config_manager.EMS_API_URL}/api/v1/nodes/heartbeat"
+    url = protocol.heartbeat_url()
     headers = {"Authorization": f"Bearer {token}"}
 
     while True:
@@ -150,37 +108,24 @@ def start_heartbeat_loop(initial_config):
             telemetry = gpu_driver.get_gpu_telemetry()
             
             # 2. Prepare Payload
-            payload = {
-                "node_id": node_id,
-                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-                "metrics": {
-                    "status": "working",
-                    "system_temp_c": 40 # Placeholder for CPU temp
-                },
-                "gpu_telemetry": telemetry
-            }
+            payload = protocol.build_heartbeat_payload(node_id, telemetry)
             
             # 3. Send Heartbeat
             print(f"Sending Heartbeat... (Gpus: {len(telemetry)})")
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
+            response = protocol.post_json(url, payload, headers=headers)
             
             # 4. Handle Response
-            if response.status_code == 200:
-                data = response.json()
+            action, data = protocol.handle_heartbeat_response(response)
+            if action == protocol.HEARTBEAT_ACCEPTED:
                 watchdog.feed_watchdog()
                 # Power control is disabled until apply_power_limit is re-enabled.
                 # if data.get("command") == "adjust_power":
                 #     target_w = data.get("setpoint_power_w", 1500)
                 #     print(f"COMMAND RECEIVED: Adjust Power to {target_w}W")
 
-            elif response.status_code == 401:
-                print("UNAUTHORIZED: Token revoked. Deleting secrets and restarting.")
-                config_manager.delete_secrets()
+            elif action == protocol.REINITIALIZE:
                 return # Break loop to re-initialize
 
-            else:
-                print(f"Server warning: {response.status_code}")
-
         except requests.exceptions.RequestException as e:
             print(f"Network Error: {e}")
         
@@ -211,6 +156,18 @@ def main():
     # SAFETY: Feed watchdog immediately to prevent timeout during startup
     watchdog.feed_watchdog()
     
+    runtime_mode = config_manager.RUNTIME_MODE
+    if runtime_mode not in ("threaded", "async"):
+        print(f"Warning: Unknown RUNTIME_MODE '{runtime_mode}'. Using threaded runtime.")
+    
+    if runtime_mode == "async":
+        print("Runtime: asyncio")
+        try:
+            async_runtime.run()
+        except Exception as e:
+            # Keep the node online: fall back to the threaded state machine
+            print(f"CRITICAL: Async runtime failed: {e}. Falling back to threaded runtime.")
+    
     while True:
         # SAFETY: Feed watchdog at start of each loop iteration
         watchdog.feed_watchdog()
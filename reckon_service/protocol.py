@@ -0,0 +1,157 @@
+"""
+RECKON Client - EMS Protocol
+Purpose: Request bodies and response handling shared by the threaded and
+asyncio runtimes. Each runtime only owns its own sleeping/awaiting.
+Reference: Protocol Doc Section 2 and 3
+"""
+import time
+import requests
+
+import config_manager
+
+# --- ENDPOINTS ---
+INITIALIZE_PATH = "/api/v1/nodes/initialize"
+HEARTBEAT_PATH = "/api/v1/nodes/heartbeat"
+
+# --- HTTP TIMEOUTS ---
+# requests applies these to connect and to each socket read separately, so
+# they do not bound the whole exchange: a server that keeps sending bytes
+# slowly can hold a call open longer than their sum.
+HTTP_CONNECT_TIMEOUT_SECONDS = 5
+HTTP_READ_TIMEOUT_SECONDS = 10
+
+# Delay after server/network errors
+ERROR_RETRY_DELAY_SECONDS = 30
+
+# --- RESPONSE ACTIONS ---
+# Returned by the handlers below; the runtimes map them to a sleep or a state change.
+REGISTERED = "registered"  # 200: credentials saved, enter RUNNING
+PENDING = "pending"  # 202: waiting for admin approval
+RETRY = "retry"  # Any other status: retry after ERROR_RETRY_DELAY_SECONDS
+HEARTBEAT_ACCEPTED = "accepted"  # 200: node is alive, data may carry a command
+HEARTBEAT_REJECTED = "rejected"  # Other status: keep beating
+REINITIALIZE = "reinitialize"  # 401: secrets deleted, go back to INITIALIZING
+
+
+def initialize_url():
+    return f"{config_manager.EMS_API_URL}{INITIALIZE_PATH}"
+
+
+def heartbeat_url():
+    return f"{config_manager.EMS_API_URL}{HEARTBEAT_PATH}"
+
+
+def post_json(url, payload, headers=None):
+    """
+    POSTs a JSON payload to the EMS with a (connect, read) timeout.
+    """
+    return requests.post(
+        url, json=payload, headers=headers,
+        timeout=(HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_READ_TIMEOUT_SECONDS))
+
+
+def build_registration_payload(inventory):
+    """
+    Payload for the INITIALIZING state (/api/v1/nodes/initialize).
+    """
+    return {
+        "model": "RECKON_RIG_GEN1",
+        "fw_version": "1.0.0",
+        "capabilities": {
+            "max_power_w": 900, # Physical max
+            "min_power_w": 540
+        },
+        "gpu_inventory": inventory
+    }
+
+
+def build_heartbeat_payload(node_id, telemetry):
+    """
+    Payload for the RUNNING state (/api/v1/nodes/heartbeat).
+    """
+    return {
+        "node_id": node_id,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "metrics": {
+            "status": "working",
+            "system_temp_c": 40 # Placeholder for CPU temp
+        },
+        "gpu_telemetry": telemetry
+    }
+
+
+def load_credentials():
+    """
+    Loads (node_id, api_token) for the RUNNING state.
+    Returns None if the node has to go back to INITIALIZING.
+    """
+    secrets = config_manager.load_secrets()
+    if not secrets:
+        print("CRITICAL: Secrets lost. Restarting initialization.")
+        return None
+
+    # SAFETY: Guard against null/empty token to prevent infinite loop
+    if not secrets.get("api_token"):
+        print("CRITICAL: api_token is null or empty. Deleting secrets.")
+        config_manager.delete_secrets()
+        return None
+
+    return secrets["node_id"], secrets["api_token"]
+
+
+def handle_registration_response(response):
+    """
+    Applies an /initialize response.
+    Returns (action, data); data is the approved config for REGISTERED.
+    """
+    # CASE 1: 200 OK -> Approved
+    if response.status_code == 200:
+        data = response.json()
+        print("SUCCESS: Node Approved!")
+        config_manager.save_secrets(data["node_id"], data["api_token"])
+        return REGISTERED, data
+
+    # CASE 2: 202 Accepted -> Pending Approval
+    if response.status_code == 202:
+        print("202 body:", response.text)
+
+        data = {}
+        try:
+            data = response.json()  # server should return node_id here
+        except Exception:
+            pass
+
+        node_id = data.get("node_id")
+        if node_id:
+            config_manager.save_pending_node_id(node_id)
+
+        print(f"PENDING: Waiting for admin approval. Retrying in {config_manager.RETRY_DELAY}s...")
+        return PENDING, None
+
+    # CASE 3: Error
+    print(f"ERROR: Server returned {response.status_code}. Retrying...")
+    return RETRY, None
+
+
+def registration_retry_delay(action):
+    """Seconds to wait before the next /initialize attempt."""
+    if action == PENDING:
+        return config_manager.RETRY_DELAY
+    return ERROR_RETRY_DELAY_SECONDS
+
+
+def handle_heartbeat_response(response):
+    """
+    Applies a /heartbeat response.
+    Returns (action, data); data is the response body for HEARTBEAT_ACCEPTED.
+    """
+    if response.status_code == 200:
+        return HEARTBEAT_ACCEPTED, response.json()
+
+    if response.status_code == 401:
+        print("UNAUTHORIZED: Token revoked. Deleting secrets and restarting.")
+        config_manager.delete_secrets()
+        return REINITIALIZE, None
+
+    print(f"Server warning: {response.status_code}")
+    return HEARTBEAT_REJECTED, None
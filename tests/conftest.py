@@ -0,0 +1,36 @@
+"""
+Shared fixtures. The service modules use flat imports (import protocol),
+so reckon_service/ is put on sys.path the same way main.py runs.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reckon_service"))
+
+import config_manager  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, tag=None):
+        self.status_code = status_code
+        self._body = body
+        self.tag = tag  # Identifies which request produced this response
+
+    def json(self):
+        if self._body is None:
+            raise ValueError("no JSON body")
+        return self._body
+
+    @property
+    def text(self):
+        return "" if self._body is None else str(self._body)
+
+
+@pytest.fixture(autouse=True)
+def secrets_file(tmp_path, monkeypatch):
+    """Never touch the real secrets.json."""
+    path = tmp_path / "secrets.json"
+    monkeypatch.setattr(config_manager, "SECRETS_FILE", str(path))
+    return path
@@ -0,0 +1,221 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import async_runtime
+import config_manager
+import gpu_driver
+import protocol
+
+from conftest import FakeResponse
+
+INITIALIZE_URL = "http://ems/api/v1/nodes/initialize"
+HEARTBEAT_URL = "http://ems/api/v1/nodes/heartbeat"
+
+
+@pytest.fixture
+def runtime(monkeypatch):
+    monkeypatch.setattr(config_manager, "EMS_API_URL", "http://ems")
+    monkeypatch.setattr(config_manager, "DEFAULT_HEARTBEAT_INTERVAL", 0.05)
+    monkeypatch.setattr(config_manager, "RETRY_DELAY", 0.01)
+    monkeypatch.setattr(protocol, "ERROR_RETRY_DELAY_SECONDS", 0.01)
+    monkeypatch.setattr(gpu_driver, "get_gpu_inventory", lambda: [])
+    monkeypatch.setattr(gpu_driver, "get_gpu_telemetry", lambda: [{"gpu_id": "gpu_0"}])
+    rt = async_runtime.AsyncRuntime()
+    yield rt
+    rt._ems_executor.shutdown(wait=True)
+    rt._gpu_executor.shutdown(wait=True)
+
+
+class FakeEms:
+    """Stands in for protocol.post_json; answers from a per-URL script."""
+
+    def __init__(self, script):
+        self.script = script
+        self.sent = []
+
+    def __call__(self, url, payload, headers=None):
+        self.sent.append((url, payload))
+        responses = self.script[url]
+        return responses.pop(0) if len(responses) > 1 else responses[0]
+
+
+def run(coro, timeout=5):
+    async def bounded():
+        return await asyncio.wait_for(coro, timeout)
+    return asyncio.run(bounded())
+
+
+def start_running(rt):
+    """Creates the loop-bound queues that run() normally sets up."""
+    rt._samples = asyncio.Queue(maxsize=1)
+    rt._commands = asyncio.Queue()
+
+
+# --- State machine ---
+
+def test_register_node_retries_until_approved(runtime, monkeypatch):
+    ems = FakeEms({INITIALIZE_URL: [
+        FakeResponse(500),
+        FakeResponse(202, {"node_id": "node-pending-1"}),
+        FakeResponse(200, {"node_id": "node-1", "api_token": "tok"}),
+    ]})
+    monkeypatch.setattr(protocol, "post_json", ems)
+
+    data = run(runtime._register_node())
+
+    assert data["api_token"] == "tok"
+    assert len(ems.sent) == 3
+    assert protocol.load_credentials() == ("node-1", "tok")
+
+
+def test_run_node_tears_down_all_tasks_on_reinitialize(runtime, monkeypatch, capsys):
+    config_manager.save_secrets("node-1", "tok")
+    ems = FakeEms({HEARTBEAT_URL: [
+        FakeResponse(200, {"command": "adjust_power", "setpoint_power_w": 700}),
+        FakeResponse(503),
+        FakeResponse(401),
+    ]})
+    monkeypatch.setattr(protocol, "post_json", ems)
+
+    async def scenario():
+        start_running(runtime)
+        before = asyncio.all_tasks()
+        await runtime._run_node()
+        return {task for task in asyncio.all_tasks() - before if not task.done()}
+
+    leftover = run(scenario())
+
+    assert leftover == set()
+    assert len(ems.sent) == 3
+    assert protocol.load_credentials() is None
+    assert "Adjust Power to 700W" in capsys.readouterr().out
+
+
+def test_one_sample_per_beat_and_none_before_running(runtime, monkeypatch):
+    config_manager.save_secrets("node-1", "tok")
+    samples = []
+    monkeypatch.setattr(gpu_driver, "get_gpu_telemetry", lambda: samples.append(1) or [])
+    ems = FakeEms({
+        INITIALIZE_URL: [FakeResponse(202), FakeResponse(202), FakeResponse(202)],
+        HEARTBEAT_URL: [FakeResponse(200, {})] * 3 + [FakeResponse(401)],
+    })
+    monkeypatch.setattr(protocol, "post_json", ems)
+
+    async def scenario():
+        start_running(runtime)
+        register = asyncio.ensure_future(runtime._register_node())
+        await asyncio.sleep(0.1)
+        register.cancel()
+        assert samples == []
+        await runtime._run_node()
+
+    run(scenario())
+
+    beats = [url for url, _ in ems.sent if url == HEARTBEAT_URL]
+    assert len(beats) == 4
+    assert len(samples) in (4, 5)  # The sampler may have started the next beat
+
+
+# --- In-flight calls and deadlines ---
+
+class BlockingEms(FakeEms):
+    """Blocks the first request until released, like a hung server."""
+
+    def __init__(self, script):
+        super().__init__(script)
+        self.release = threading.Event()
+
+    def __call__(self, url, payload, headers=None):
+        if not self.sent:
+            self.sent.append((url, payload))
+            self.release.wait(5)
+            return FakeResponse(200, {"for": payload}, tag=payload)
+        return super().__call__(url, payload, headers)
+
+
+def test_timed_out_heartbeat_is_never_reused(runtime, monkeypatch):
+    monkeypatch.setattr(async_runtime, "HTTP_DEADLINE_SECONDS", 0.1)
+    ems = BlockingEms({HEARTBEAT_URL: [None]})
+    ems.script[HEARTBEAT_URL] = [FakeResponse(200, tag="beat-3")]
+    monkeypatch.setattr(protocol, "post_json", ems)
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await runtime._post(HEARTBEAT_URL, "beat-1")
+        assert runtime._worker_busy(runtime._ems_executor)
+
+        # Busy worker: the second beat waits, then times out unsent
+        with pytest.raises(asyncio.TimeoutError):
+            await runtime._post(HEARTBEAT_URL, "beat-2")
+
+        ems.release.set()
+        return await runtime._post(HEARTBEAT_URL, "beat-3")
+
+    response = run(scenario())
+
+    assert response.tag == "beat-3"
+    assert [payload for _, payload in ems.sent] == ["beat-1", "beat-3"]
+
+
+def test_heartbeat_loop_skips_beat_while_worker_busy(runtime, monkeypatch, capsys):
+    monkeypatch.setattr(async_runtime, "HTTP_DEADLINE_SECONDS", 0.1)
+    ems = BlockingEms({HEARTBEAT_URL: [FakeResponse(401)]})
+    monkeypatch.setattr(protocol, "post_json", ems)
+
+    async def scenario():
+        start_running(runtime)
+        with pytest.raises(asyncio.TimeoutError):
+            await runtime._post(HEARTBEAT_URL, "beat-1")
+        beats = asyncio.ensure_future(runtime._heartbeat_loop("node-1", "tok"))
+        runtime._samples.put_nowait([])
+        await asyncio.sleep(0.05)
+        ems.release.set()
+        await asyncio.sleep(0.05)
+        runtime._samples.put_nowait([])
+        await beats
+
+    run(scenario())
+
+    assert "Skipping heartbeat" in capsys.readouterr().out
+    assert len(ems.sent) == 2
+
+
+def test_registration_retry_takes_result_that_finished_meanwhile(runtime, monkeypatch):
+    monkeypatch.setattr(async_runtime, "HTTP_DEADLINE_SECONDS", 0.1)
+    ems = BlockingEms({INITIALIZE_URL: [FakeResponse(500, tag="second-request")]})
+    monkeypatch.setattr(protocol, "post_json", ems)
+    key = (INITIALIZE_URL, "payload")
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await runtime._post(INITIALIZE_URL, "reg", key=key)
+        ems.release.set()
+        await asyncio.sleep(0.1)  # Finishes during the retry delay
+        return await runtime._post(INITIALIZE_URL, "reg", key=key)
+
+    response = run(scenario())
+
+    assert response.tag == "reg"
+    assert len(ems.sent) == 1
+
+
+def test_waiting_for_worker_and_call_share_one_deadline(runtime):
+    release = threading.Event()
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        with pytest.raises(asyncio.TimeoutError):
+            await runtime._call(runtime._gpu_executor, None, 0.05, release.wait, 5)
+
+        loop.call_later(0.2, release.set)  # Worker frees halfway through
+        started = loop.time()
+        with pytest.raises(asyncio.TimeoutError):
+            await runtime._call(runtime._gpu_executor, None, 0.4, time.sleep, 1)
+        return loop.time() - started
+
+    elapsed = run(scenario())
+
+    assert elapsed < 0.5
@@ -0,0 +1,87 @@
+import config_manager
+import protocol
+
+from conftest import FakeResponse
+
+
+def test_registration_200_saves_credentials():
+    response = FakeResponse(200, {"node_id": "node-1", "api_token": "tok"})
+
+    action, data = protocol.handle_registration_response(response)
+
+    assert action == protocol.REGISTERED
+    assert data["node_id"] == "node-1"
+    assert config_manager.load_secrets() == {"node_id": "node-1", "api_token": "tok"}
+
+
+def test_registration_202_is_pending_and_saves_nothing(monkeypatch):
+    monkeypatch.setattr(config_manager, "RETRY_DELAY", 7)
+    response = FakeResponse(202, {"node_id": "node-pending-1"})
+
+    action, data = protocol.handle_registration_response(response)
+
+    assert (action, data) == (protocol.PENDING, None)
+    assert config_manager.load_secrets() is None
+    assert protocol.registration_retry_delay(action) == 7
+
+
+def test_registration_202_without_body_is_pending():
+    action, _ = protocol.handle_registration_response(FakeResponse(202))
+
+    assert action == protocol.PENDING
+
+
+def test_registration_other_status_retries_after_error_delay():
+    action, data = protocol.handle_registration_response(FakeResponse(500))
+
+    assert (action, data) == (protocol.RETRY, None)
+    assert protocol.registration_retry_delay(action) == protocol.ERROR_RETRY_DELAY_SECONDS
+
+
+def test_heartbeat_200_is_accepted_with_body():
+    body = {"command": "adjust_power", "setpoint_power_w": 700}
+
+    action, data = protocol.handle_heartbeat_response(FakeResponse(200, body))
+
+    assert (action, data) == (protocol.HEARTBEAT_ACCEPTED, body)
+
+
+def test_heartbeat_401_deletes_secrets_and_reinitializes(secrets_file):
+    config_manager.save_secrets("node-1", "tok")
+
+    action, _ = protocol.handle_heartbeat_response(FakeResponse(401))
+
+    assert action == protocol.REINITIALIZE
+    assert not secrets_file.exists()
+
+
+def test_heartbeat_other_status_is_rejected_and_keeps_secrets(secrets_file):
+    config_manager.save_secrets("node-1", "tok")
+
+    action, _ = protocol.handle_heartbeat_response(FakeResponse(503))
+
+    assert action == protocol.HEARTBEAT_REJECTED
+    assert secrets_file.exists()
+
+
+def test_load_credentials():
+    assert protocol.load_credentials() is None
+
+    config_manager.save_secrets("node-1", "")
+    assert protocol.load_credentials() is None
+
+    config_manager.save_secrets("node-1", "tok")
+    assert protocol.load_credentials() == ("node-1", "tok")
+
+
+def test_post_json_uses_connect_read_timeout(monkeypatch):
+    calls = []
+    monkeypatch.setattr(protocol.requests, "post", lambda url, **kwargs: calls.append((url, kwargs)))
+
+    protocol.post_json("http://ems/x", {"a": 1}, headers={"h": "v"})
+
+    assert calls == [("http://ems/x", {
+        "json": {"a": 1},
+        "headers": {"h": "v"},
+        "timeout": (protocol.HTTP_CONNECT_TIMEOUT_SECONDS, protocol.HTTP_READ_TIMEOUT_SECONDS),
+    })]